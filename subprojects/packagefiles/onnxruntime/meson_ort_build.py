@@ -1,13 +1,28 @@
 import os
 import re
 import sys
+import json
 import shutil
 import hashlib
 import argparse
+import functools
+import contextlib
+import collections
 import subprocess
 from pathlib import Path
 from typing import Dict, List, Optional
 
+try:
+    import fcntl
+except ImportError:  # non-Unix: no locking, builds must not run concurrently
+    fcntl = None
+
+try:
+    # Non-cryptographic cache keys: prefer blake3 (SIMD-tuned) when installed
+    from blake3 import blake3 as _sig_hash
+except ImportError:
+    _sig_hash = hashlib.sha256
+
 
 LOG_PREFIX = "[onnxruntime-wrap]"
 
@@ -16,41 +31,80 @@ def log(msg: str) -> None:
     print(f"{LOG_PREFIX} {msg}", flush=True)
 
 
+# Stream child output directly to our stdio (set by --verbose)
+VERBOSE = False
+
+# Lines of child output kept for the failure report
+TAIL_LINES = 200
+
+
 def run(cmd: List[str], cwd: Optional[Path] = None) -> None:
     log(" ".join(map(str, cmd)))
     log(f"env CC  = {os.environ.get('CC')}")
     log(f"env CXX = {os.environ.get('CXX')}")
-    subprocess.check_call(list(map(str, cmd)), cwd=str(cwd) if cwd else None)
 
+    argv = list(map(str, cmd))
+    cwd_s = str(cwd) if cwd else None
 
-def run_capture(cmd: List[str]) -> str:
+    if VERBOSE:
+        subprocess.check_call(argv, cwd=cwd_s)
+        return
+
+    # ORT compilation emits 100k+ lines; keep only a tail ring buffer instead
+    # of flooding the (possibly slow) log pipe.
+    p = subprocess.Popen(
+        argv,
+        cwd=cwd_s,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.STDOUT,
+        text=True,
+        errors="replace",
+    )
+    ring = collections.deque(p.stdout, maxlen=TAIL_LINES)
+    rc = p.wait()
+    if rc != 0:
+        log(f"Command failed (rc={rc}), last {len(ring)} output lines:")
+        for line in ring:
+            sys.stdout.write(line)
+        sys.stdout.flush()
+        raise subprocess.CalledProcessError(rc, argv)
+
+
+@functools.lru_cache(maxsize=None)
+def _run_capture_cached(cmd: tuple) -> str:
     try:
-        out = subprocess.check_output(list(map(str, cmd)), stderr=subprocess.STDOUT)
+        out = subprocess.check_output(list(cmd), stderr=subprocess.STDOUT, stdin=subprocess.DEVNULL)
         return out.decode("utf-8", errors="ignore").strip()
     except Exception:
         return ""
 
 
+def run_capture(cmd: List[str]) -> str:
+    """Capture probe output; memoized since each spawn costs tens of ms."""
+    return _run_capture_cached(tuple(map(str, cmd)))
+
+
 def join_flags(*chunks) -> str:
-    """Join compiler flags from lists/strings preserving order."""
+    """Join compiler flags from lists/strings preserving order, dropping duplicates."""
     out: List[str] = []
+    seen = set()
     for c in chunks:
         if not c:
             continue
         if isinstance(c, (list, tuple)):
-            out.extend([str(x) for x in c if str(x).strip()])
+            # Stringify once per item; stripping here also keeps dedup from
+            # treating ' -O2' and '-O2' as different flags
+            items = [s for x in c if (s := str(x).strip())]
         else:
-            out.extend([x for x in str(c).split() if x.strip()])
+            # split() already drops empty and all-whitespace tokens
+            items = str(c).split()
+        for x in items:
+            if x not in seen:
+                seen.add(x)
+                out.append(x)
     return " ".join(out)
 
 
-def is_apple_clang(cxx_bin: str) -> bool:
-    if not cxx_bin:
-        return False
-    ver = run_capture([cxx_bin, "--version"])
-    return "Apple clang" in ver
-
-
 def compiler_kind(cxx_bin: str) -> str:
     if not cxx_bin:
         return "unknown"
@@ -101,11 +155,33 @@ def _candidate_dirs_from_compiler_prefix(cxx_bin: str) -> List[Path]:
     return dirs
 
 
+def _candidate_dirs_from_driver_dump(cxx_bin: str) -> List[Path]:
+    """
+    Parse linker search dirs (-L) from a single `-###` driver dump instead of
+    spawning the compiler once per candidate library name.
+    """
+    out = run_capture([cxx_bin, "-###", "-x", "c++", "-stdlib=libc++", "-", "-o", os.devnull])
+    if not out:
+        return []
+    dirs: List[Path] = []
+    for quoted, spaced in re.findall(r'"-L([^"]+)"|"-L"\s+"([^"]+)"', out):
+        p = Path(quoted or spaced)
+        if p.exists():
+            dirs.append(p)
+    return dirs
+
+
 def detect_runtime_lib_dir(cxx_bin: str, libnames: List[str]) -> Optional[Path]:
     if not cxx_bin:
         return None
 
-    # 1) Preferred: ask compiler directly.
+    # 1) Preferred: one driver dump, then pure-Python existence checks.
+    for d in _candidate_dirs_from_driver_dump(cxx_bin):
+        for libname in libnames:
+            if (d / libname).exists():
+                return d
+
+    # 2) Ask compiler per library name.
     for libname in libnames:
         cand = run_capture([cxx_bin, "-print-file-name=" + libname])
         if not cand:
@@ -114,7 +190,7 @@ def detect_runtime_lib_dir(cxx_bin: str, libnames: List[str]) -> Optional[Path]:
         if p.is_absolute() and p.exists():
             return p.parent
 
-    # 2) Search in compiler-reported library dirs.
+    # 3) Search in compiler-reported library dirs.
     dirs = _candidate_dirs_from_search_dirs(cxx_bin) + _candidate_dirs_from_compiler_prefix(cxx_bin)
     seen = set()
     for d in dirs:
@@ -128,6 +204,57 @@ def detect_runtime_lib_dir(cxx_bin: str, libnames: List[str]) -> Optional[Path]:
     return None
 
 
+def _flags_accepted(cxx_bin: str, flags: List[str]) -> bool:
+    """One -fsyntax-only invocation answering 'does the compiler accept all of these?'."""
+    r = subprocess.run(
+        [cxx_bin, "-x", "c++", "-fsyntax-only", "-Werror", *flags, "-"],
+        input=b"",
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    return r.returncode == 0
+
+
+def supported_flags(cxx_bin: str, flags: List[str], cache_root: Path) -> List[str]:
+    """
+    Filter flags down to those the compiler accepts.
+
+    All candidates are probed in a single batched compile first; only if that
+    fails are the unknown ones probed individually. Results are cached under
+    cache_root keyed by compiler path+mtime, so repeat runs spawn nothing.
+    """
+    if not cxx_bin:
+        return list(flags)
+
+    resolved = shutil.which(cxx_bin) or cxx_bin
+    try:
+        key = f"{resolved}:{os.stat(resolved).st_mtime_ns}"
+    except OSError:
+        key = resolved
+    cache_file = cache_root / "toolchain_probe" / (hashlib.sha256(key.encode("utf-8")).hexdigest()[:16] + ".json")
+
+    try:
+        cache: Dict[str, bool] = json.loads(cache_file.read_text())
+    except (OSError, ValueError):
+        cache = {}
+
+    missing = [f for f in flags if f not in cache]
+    if missing:
+        if _flags_accepted(cxx_bin, missing):
+            for f in missing:
+                cache[f] = True
+        else:
+            for f in missing:
+                cache[f] = _flags_accepted(cxx_bin, [f])
+        cache_file.parent.mkdir(parents=True, exist_ok=True)
+        cache_file.write_text(json.dumps(cache, indent=2, sort_keys=True) + "\n")
+
+    dropped = [f for f in flags if not cache[f]]
+    if dropped:
+        log(f"Dropping unsupported flags: {' '.join(dropped)}")
+    return [f for f in flags if cache[f]]
+
+
 def parse_extra_defines(extra: str) -> List[str]:
     """Parse semicolon-separated KEY=VALUE items."""
     extra = (extra or "").strip()
@@ -207,14 +334,48 @@ def ensure_soname_symlink(lib_dir: Path) -> None:
     candidates.sort(key=lambda p: (natural_version_key(p), p.name))
     chosen = candidates[-1]
 
+    # Create at a temp name and rename into place: concurrent invocations then
+    # race atomically instead of observing a half-written entry (and
+    # triggering a spurious full rebuild on the next run).
+    tmp = want.with_name(f"{want.name}.tmp.{os.getpid()}")
     try:
-        want.symlink_to(chosen.name)  # relative symlink (same dir)
+        tmp.symlink_to(chosen.name)  # relative symlink (same dir)
+        os.replace(tmp, want)
         log(f"Created symlink {want.name} -> {chosen.name}")
     except Exception:
+        try:
+            tmp.unlink()
+        except OSError:
+            pass
         shutil.copy2(chosen, want)
         log(f"Copied {chosen.name} -> {want.name}")
 
 
+@contextlib.contextmanager
+def fetchcontent_lock(fetchcontent_dir: Path):
+    """
+    Serialize configure/build against the shared FETCHCONTENT_BASE_DIR.
+    Parallel meson invocations would otherwise race on _deps/<pkg>-src.
+    """
+    if fcntl is None:
+        yield
+        return
+    lock_path = Path(fetchcontent_dir) / ".lock"
+    with lock_path.open("w") as fd:
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+
+
+def build_jobs() -> int:
+    """CPUs actually available to this process (cgroup/affinity aware)."""
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 4
+
+
 def default_cache_root() -> Path:
     xdg = os.environ.get("XDG_CACHE_HOME")
     if xdg:
@@ -228,26 +389,44 @@ def compute_toolchain_signature(
     acl: str,
     xnnpack: str,
     extra: str,
+    lto: str,
 ) -> str:
     """
     Signature determines ORT build/install dir. If any of these changes -> new build.
+
+    Only coarse ABI-relevant inputs are hashed (compiler identity/version and
+    feature toggles). CFLAGS/CXXFLAGS deliberately do NOT fork the install tree:
+    flag churn is handled by the compiler cache (see compute_flags_digest), so a
+    whitespace change in env flags no longer triggers a cold rebuild.
     Note: FETCHCONTENT download cache is shared per ORT version, not per signature.
     """
+    cc = os.environ.get("CC", "").strip()
+    cxx = os.environ.get("CXX", "").strip()
     parts = [
         ort_version,
-        os.environ.get("CC", "").strip(),
-        os.environ.get("CXX", "").strip(),
-        os.environ.get("CFLAGS", "").strip(),
-        os.environ.get("CXXFLAGS", "").strip(),
+        cc,
+        cxx,
+        run_capture([cxx, "--version"]) if cxx else "",
         str(tests),
         str(acl),
         str(xnnpack),
         (extra or "").strip(),
+        str(lto),
     ]
-    digest = hashlib.sha256("|".join(parts).encode("utf-8")).hexdigest()
+    digest = _sig_hash("|".join(parts).encode("utf-8")).hexdigest()
     return digest[:12]
 
 
+def compute_flags_digest() -> str:
+    """Fine-grained digest of env compile flags, used only to key the compiler cache."""
+    parts = [
+        os.environ.get("CFLAGS", "").strip(),
+        os.environ.get("CXXFLAGS", "").strip(),
+        os.environ.get("LDFLAGS", "").strip(),
+    ]
+    return _sig_hash("|".join(parts).encode("utf-8")).hexdigest()[:12]
+
+
 def cmake_defines(
     install_dir: Path,
     fetchcontent_dir: Path,
@@ -257,6 +436,8 @@ def cmake_defines(
     tests: str,
     acl: str,
     xnnpack: str,
+    unity: str,
+    lto: str,
 ) -> Dict[str, str]:
 
     defs: Dict[str, str] = {
@@ -304,8 +485,10 @@ def cmake_defines(
         "onnxruntime_USE_DML": "OFF",
 
         # Optional: reduce build time / size
+        # (LTO roughly doubles link time and single-threads the final link,
+        # so it stays opt-in via --lto)
         "onnxruntime_DISABLE_ML_OPS": "ON",
-        "onnxruntime_ENABLE_LTO": "ON",
+        "onnxruntime_ENABLE_LTO": "ON" if lto != "off" else "OFF",
         "onnxruntime_BUILD_FOR_NATIVE_MACHINE": "ON",
 
         # Optional EPs
@@ -316,6 +499,11 @@ def cmake_defines(
         "onnxruntime_USE_MIMALLOC": "OFF",
     }
 
+    # Batch TUs so one compiler process amortizes startup/template costs
+    if unity == "1":
+        defs["CMAKE_UNITY_BUILD"] = "ON"
+        defs["CMAKE_UNITY_BUILD_BATCH_SIZE"] = "16"
+
     # Toolchain selection
     cc = os.environ.get("CC", "").strip()
     cxx = os.environ.get("CXX", "").strip()
@@ -324,17 +512,75 @@ def cmake_defines(
     if cxx:
         defs["CMAKE_CXX_COMPILER"] = cxx
 
+    # Compiler cache (warm rebuilds of ~1000 ORT TUs drop to seconds)
+    launcher = detect_compiler_launcher()
+    if launcher:
+        defs["CMAKE_C_COMPILER_LAUNCHER"] = launcher
+        defs["CMAKE_CXX_COMPILER_LAUNCHER"] = launcher
+
     return defs
 
 
-def is_built(install_dir: Path) -> bool:
-    """Heuristic: ORT is built+installed if lib exists."""
-    lib_dir = install_dir / "lib"
-    if not lib_dir.exists():
-        return False
-    if sys.platform == "darwin":
-        return any(lib_dir.glob("libonnxruntime*.dylib"))
-    return any(lib_dir.glob("libonnxruntime.so*"))
+def detect_compiler_launcher() -> Optional[str]:
+    """Find ccache (or sccache) to front compiler invocations, if installed."""
+    return shutil.which(os.environ.get("CCACHE", "ccache")) or shutil.which("sccache")
+
+
+def need_configure(build_dir: Path, cmake_cmd: List[str], cmake_src_dir: Path) -> bool:
+    """
+    True if the CMake configure step must run. Skipped when CMakeCache.txt is
+    present, the recorded configure argv hash matches the current one, and the
+    cache is not older than the top-level CMakeLists.txt.
+    """
+    cache_file = build_dir / "CMakeCache.txt"
+    sha_file = build_dir / ".ort_wrap_argv_sha"
+    if not cache_file.exists() or not sha_file.exists():
+        return True
+
+    argv_sha = hashlib.sha256("\0".join(map(str, cmake_cmd)).encode("utf-8")).hexdigest()
+    try:
+        if sha_file.read_text().strip() != argv_sha:
+            return True
+        lists_file = cmake_src_dir / "CMakeLists.txt"
+        if lists_file.exists() and cache_file.stat().st_mtime < lists_file.stat().st_mtime:
+            return True
+    except OSError:
+        return True
+    return False
+
+
+def record_configure(build_dir: Path, cmake_cmd: List[str]) -> None:
+    argv_sha = hashlib.sha256("\0".join(map(str, cmake_cmd)).encode("utf-8")).hexdigest()
+    (build_dir / ".ort_wrap_argv_sha").write_text(argv_sha + "\n")
+
+
+def manifest_path(install_dir: Path) -> Path:
+    return install_dir / ".ort_manifest.json"
+
+
+def write_manifest(install_dir: Path, ort_version: str, tool_sig: str, lib_path: Path) -> None:
+    manifest = {
+        "version": ort_version,
+        "sig": tool_sig,
+        "lib": str(lib_path),
+        "mtime": lib_path.stat().st_mtime if lib_path.exists() else 0,
+    }
+    manifest_path(install_dir).write_text(json.dumps(manifest, indent=2) + "\n")
+
+
+def is_built(install_dir: Path, tool_sig: str) -> bool:
+    """ORT is built+installed if the install manifest matches and its lib exists."""
+    try:
+        manifest = json.loads(manifest_path(install_dir).read_text())
+    except (OSError, ValueError):
+        # No/corrupt manifest (e.g. install predating it): fall back to globbing
+        lib_dir = install_dir / "lib"
+        if not lib_dir.exists():
+            return False
+        if sys.platform == "darwin":
+            return any(lib_dir.glob("libonnxruntime*.dylib"))
+        return any(lib_dir.glob("libonnxruntime.so*"))
+    return manifest.get("sig") == tool_sig and Path(manifest.get("lib", "")).exists()
 
 
 def main() -> None:
@@ -348,12 +594,19 @@ def main() -> None:
     ap.add_argument("--acl", required=True)
     ap.add_argument("--xnnpack", required=True)
     ap.add_argument("--extra", default="")
+    ap.add_argument("--unity", default="1", help="1 = batch ORT TUs via CMAKE_UNITY_BUILD (default), 0 = off")
+    ap.add_argument("--lto", choices=["off", "thin", "full"], default="off",
+                    help="Link-time optimization for ORT (default: off)")
     ap.add_argument("--cache-root", default="")  # will auto fetch
     ap.add_argument("--ort-ver", default="")
     ap.add_argument("--force", action="store_true")
     ap.add_argument("--skip-if-built", action="store_true", help="Skip build/install if ORT already installed")
+    ap.add_argument("--verbose", action="store_true", help="Stream full build output instead of tail-on-failure")
     args = ap.parse_args()
 
+    global VERBOSE
+    VERBOSE = args.verbose
+
     ort_version = (args.ort_ver or "unknown").strip()
 
     cmake_src_dir = Path(args.src) / "cmake"
@@ -369,6 +622,7 @@ def main() -> None:
         acl=args.acl,
         xnnpack=args.xnnpack,
         extra=args.extra,
+        lto=args.lto,
     )
 
     # Persistent dirs
@@ -391,35 +645,34 @@ def main() -> None:
     ensure_symlink(meson_build_link, persistent_build_dir)
     ensure_symlink(meson_install_link, persistent_install_dir)
 
-    # Flags
-    suppress_warn = [
-        "-Wno-unused-parameter",
-        "-Wno-unused-variable",
-        "-Wno-deprecated-declarations",
-    ]
-
-    suppress_werror = [
-        "-Wno-error=unused-parameter",
-        "-Wno-error=unused-variable",
-        "-Wno-error=deprecated-declarations",
-    ]
-
+    # Flags (-w already silences all warnings, so no per-warning suppressions)
     common = [
-        "-mcpu=native",
         "-mcpu=native",
         "-fno-strict-aliasing",
         "-ffast-math",
         "-fno-math-errno",
-        "-fno-math-errno",
         "-ffp-contract=fast",
         "-w",
+
+        # Hidden-by-default visibility: ORT's C API keeps its explicit
+        # default-visibility attributes, everything else stays out of .dynsym
+        "-fvisibility=hidden",
+        "-fvisibility-inlines-hidden",
+        "-fno-plt",
     ]
 
-    c_flags = join_flags(common, suppress_warn, suppress_werror, os.environ.get("CFLAGS", ""))
+    lto_flags = ["-flto=thin"] if args.lto == "thin" else []
+
+    cxx_bin = os.environ.get("CXX", "").strip()
+
+    # Weed out flags this compiler rejects (e.g. -mcpu=native on x86 targets);
+    # probed in one batched invocation and cached per compiler
+    common = supported_flags(cxx_bin, common, cache_root)
+
+    c_flags = join_flags(common, lto_flags, os.environ.get("CFLAGS", ""))
 
     stdlib_compile = []
     stdlib_linker = []
-    cxx_bin = os.environ.get("CXX", "").strip()
     if sys.platform == "darwin" and cxx_bin:
         kind = compiler_kind(cxx_bin)
 
@@ -444,8 +697,8 @@ def main() -> None:
             else:
                 log("Detected g++ but libstdc++.dylib path was not resolved")
 
-    cxx_flags = join_flags(common, suppress_warn, suppress_werror, stdlib_compile, os.environ.get("CXXFLAGS", ""))
-    linker_flags = join_flags(stdlib_linker, os.environ.get("LDFLAGS", ""))
+    cxx_flags = join_flags(common, lto_flags, stdlib_compile, os.environ.get("CXXFLAGS", ""))
+    linker_flags = join_flags(lto_flags, stdlib_linker, os.environ.get("LDFLAGS", ""))
 
     defs = cmake_defines(
         install_dir=persistent_install_dir,
@@ -456,6 +709,8 @@ def main() -> None:
         tests=args.tests,
         acl=args.acl,
         xnnpack=args.xnnpack,
+        unity=args.unity,
+        lto=args.lto,
     )
 
     # CMake configure command
@@ -466,7 +721,8 @@ def main() -> None:
         "-S", str(cmake_src_dir),
         "-B", str(persistent_build_dir),
     ]
-    if shutil.which("ninja"):
+    use_ninja = bool(shutil.which("ninja"))
+    if use_ninja:
         cmake_cmd += ["-G", "Ninja"]
     for k, v in defs.items():
         cmake_cmd.append(f"-D{k}={v}")
@@ -474,22 +730,42 @@ def main() -> None:
     for kv in parse_extra_defines(args.extra):
         cmake_cmd.append("-D" + kv)
 
+    # Make ccache hits survive build-dir relocation and compiler mtime churn.
+    # Env flag changes invalidate the cache (via CCACHE_EXTRAFILES) without
+    # forking a new install tree.
+    if detect_compiler_launcher():
+        os.environ.setdefault("CCACHE_BASEDIR", str(cache_root))
+        os.environ.setdefault("CCACHE_COMPILERCHECK", "content")
+        flags_sig_file = persistent_build_dir / ".flags_sig"
+        flags_sig_file.write_text(compute_flags_digest() + "\n")
+        os.environ.setdefault("CCACHE_EXTRAFILES", str(flags_sig_file))
+
     # Build/install
-    if args.skip_if_built and is_built(persistent_install_dir):
+    if args.skip_if_built and is_built(persistent_install_dir, tool_sig):
         log(f"Skip: already installed at {persistent_install_dir}")
     else:
-        run(cmake_cmd)
-        run([
-            args.cmake, "--build", str(persistent_build_dir), "--config", "Release",
-            "--parallel", str(os.cpu_count() or 4),
-        ])
-        run([args.cmake, "--install", str(persistent_build_dir), "--config", "Release"])
+        with fetchcontent_lock(fetchcontent_dir):
+            if need_configure(persistent_build_dir, cmake_cmd, cmake_src_dir):
+                run(cmake_cmd)
+                record_configure(persistent_build_dir, cmake_cmd)
+            else:
+                log("Skip configure: CMakeCache.txt is up to date")
+            build_cmd = [args.cmake, "--build", str(persistent_build_dir), "--config", "Release"]
+            if not use_ninja:
+                # Ninja schedules its own jobs better than a fixed --parallel
+                build_cmd += ["--parallel", str(build_jobs())]
+            run(build_cmd)
+            run([args.cmake, "--install", str(persistent_build_dir), "--config", "Release"])
 
     lib_dir = persistent_install_dir / "lib"
     if not lib_dir.exists():
         raise FileNotFoundError(f"Install libdir not found: {lib_dir}")
 
     ensure_soname_symlink(lib_dir)
+
+    soname = "libonnxruntime.dylib" if sys.platform == "darwin" else "libonnxruntime.so"
+    write_manifest(persistent_install_dir, ort_version, tool_sig, lib_dir / soname)
+
     Path(args.stamp).touch()
 
     log(f"ORT={ort_version} sig={tool_sig}")
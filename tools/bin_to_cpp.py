@@ -3,32 +3,88 @@
 import argparse
 from pathlib import Path
 
-def main():
-    ap = argparse.ArgumentParser()
-    ap.add_argument("--name", required=True)
-    ap.add_argument("--input", required=True)
-    ap.add_argument("--output", required=True)
-    args = ap.parse_args()
+# One formatted token per possible byte value; avoids a per-byte f-string
+# in the hot loop (multi-MB model blobs are interpreter-bound otherwise).
+_TOK = tuple(f'0x{b:02x}' for b in range(256))
+
+def emit_initlist(name: str, data: bytes, out_path: Path) -> None:
+    """Classic byte-per-element initializer list (portable, slow to compile)."""
+    # Stream lines through a buffered handle instead of materializing the
+    # whole ~6x-blob-size string in memory first.
+    with out_path.open('w', buffering=1 << 20) as f:
+        f.write('#include <cstddef>\n')
+        f.write('namespace idet::internal {\n')
+        f.write(f'alignas(64) extern const unsigned char {name}[] = {{\n')
+
+        # 12 bytes per line
+        tok = _TOK
+        for i in range(0, len(data), 12):
+            f.write('  ' + ', '.join(map(tok.__getitem__, data[i:i+12])) + ',\n')
+
+        f.write('};\n')
+        f.write(f'extern const std::size_t {name}_len = {len(data)};\n')
+        f.write('} // namespace idet::internal\n')
+
+def mangled_symbol(name: str) -> str:
+    """Itanium-mangled name of idet::internal::<name> (gcc/clang only)."""
+    return f'_ZN4idet8internal{len(name)}{name}E'
 
-    data = Path(args.input).read_bytes()
-    name = args.name
+def emit_incbin(name: str, input_path: Path, size: int, out_path: Path) -> None:
+    """
+    Pull the blob in via the assembler (.incbin) so the C++ front-end never
+    parses the bytes. Compiles in constant time regardless of blob size.
+    The asm block defines the Itanium-mangled symbol directly, so consumers of
+    idet::internal::<name> link against it unchanged (gcc/clang only).
+    """
+    sym = mangled_symbol(name)
+    src = str(input_path.resolve())
 
     out = []
+    out.append(f'// Generated by tools/bin_to_cpp.py --mode incbin from {input_path.name}\n')
     out.append('#include <cstddef>\n')
     out.append('namespace idet::internal {\n')
-    out.append(f'alignas(64) extern const unsigned char {name}[] = {{\n')
+    out.append(f'extern const unsigned char {name}[];\n')
+    out.append(f'extern const std::size_t {name}_len = {size};\n')
+    out.append('} // namespace idet::internal\n')
+    out.append('#if defined(__APPLE__)\n')
+    out.append('__asm__(\n')
+    out.append('    ".section __TEXT,__const\\n"\n')
+    out.append('    ".balign 64\\n"\n')
+    out.append(f'    ".globl _{sym}\\n"\n')
+    out.append(f'    "_{sym}:\\n"\n')
+    out.append(f'    ".incbin \\"{src}\\"\\n"\n')
+    out.append(');\n')
+    out.append('#else\n')
+    out.append('__asm__(\n')
+    out.append('    ".section .rodata\\n"\n')
+    out.append('    ".balign 64\\n"\n')
+    out.append(f'    ".globl {sym}\\n"\n')
+    out.append(f'    ".type {sym}, %object\\n"\n')
+    out.append(f'    "{sym}:\\n"\n')
+    out.append(f'    ".incbin \\"{src}\\"\\n"\n')
+    out.append(f'    ".size {sym}, {size}\\n"\n')
+    out.append(');\n')
+    out.append('#endif\n')
 
-    # 12 bytes per line
-    for i in range(0, len(data), 12):
-        chunk = data[i:i+12]
-        out.append('  ' + ', '.join(f'0x{b:02x}' for b in chunk) + ',\n')
+    out_path.write_text(''.join(out))
 
-    out.append('};\n')
-    out.append(f'extern const std::size_t {name}_len = {len(data)};\n')
-    out.append('} // namespace idet::internal\n')
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--name", required=True)
+    ap.add_argument("--input", required=True)
+    ap.add_argument("--output", required=True)
+    ap.add_argument("--mode", choices=["initlist", "incbin"], default="initlist",
+                    help="initlist: portable initializer list; "
+                         "incbin: assembler .incbin, no front-end cost (gcc/clang)")
+    args = ap.parse_args()
+
+    input_path = Path(args.input)
+    out_path = Path(args.output)
 
-    Path(args.output).write_text(''.join(out))
+    if args.mode == "incbin":
+        emit_incbin(args.name, input_path, input_path.stat().st_size, out_path)
+    else:
+        emit_initlist(args.name, input_path.read_bytes(), out_path)
 
 if __name__ == "__main__":
     main()
-    
\ No newline at end of file
@@ -1,9 +1,16 @@
 #!/usr/bin/env python3
 
 import argparse
+import mmap
 import os
 import onnx
 
+from collections import Counter
+
+
+def _domain_norm(domain: str) -> str:
+    return domain or "ai.onnx"
+
 
 def main():
     ap = argparse.ArgumentParser()
@@ -15,22 +22,44 @@ def main():
     if not (os.path.isfile(onnx_path) and onnx_path.lower().endswith(".onnx")):
         raise FileNotFoundError(f"ONNX model not found or not an .onnx file: {onnx_path}")
 
-    m = onnx.load(onnx_path)
+    # Parse straight from an mmap'd file: no checker/validation pass, no
+    # external weight loading — only graph structure is inspected
+    with open(onnx_path, "rb") as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+            m = onnx.ModelProto()
+            m.ParseFromString(buf)
 
-    nodes = list(m.graph.node)
-    domains = sorted({(n.domain or "ai.onnx") for n in nodes})
-    ops = sorted({((n.domain or "ai.onnx"), n.op_type) for n in nodes})
+    # Domains and per-(domain, op) counts collected in one node traversal.
+    # Protobuf hands back a fresh str per field access, so intern the handful
+    # of distinct domain/op strings instead of re-normalizing and re-hashing
+    # new objects for every node.
+    dom_intern = {}
+    op_intern = {}
+    domop_counter = Counter()
+    n_nodes = 0
+    for n in m.graph.node:
+        raw_d = n.domain
+        d = dom_intern.get(raw_d)
+        if d is None:
+            d = dom_intern.setdefault(raw_d, _domain_norm(raw_d))
+        raw_op = n.op_type
+        op = op_intern.get(raw_op)
+        if op is None:
+            op = op_intern.setdefault(raw_op, raw_op)
+        domop_counter[(d, op)] += 1
+        n_nodes += 1
+    domains = sorted(set(dom_intern.values()))
 
     print("Model:", onnx_path)
     print("IR version:", getattr(m, "ir_version", "unknown"))
-    print("Opset imports:", [(o.domain or "ai.onnx", o.version) for o in m.opset_import])
+    print("Opset imports:", [(_domain_norm(o.domain), o.version) for o in m.opset_import])
 
     print("\nDomains:", domains)
     print("Has ai.onnx.ml:", "ai.onnx.ml" in domains)
 
-    print("\nUnique ops (domain, op_type):", len(ops))
-    for d, op in ops:
-        print(f"  {d}:{op}")
+    print(f"\nUnique ops (domain, op_type): {len(domop_counter)} ({n_nodes} nodes)")
+    for (d, op), count in sorted(domop_counter.items()):
+        print(f"  {d}:{op} x{count}")
 
 
 if __name__ == "__main__":
@@ -1,22 +1,37 @@
 #!/usr/bin/env python3
 
 import argparse
-import csv
+import collections
+import concurrent.futures
+import functools
+import hashlib
 import itertools
+import json
+import os
 import re
 import shlex
 import subprocess
+import threading
 from pathlib import Path
 from typing import Any, Dict, Iterable, List, Optional, Tuple
 
+try:
+    import orjson  # optional: C-level (de)serialization for the run cache
+except ImportError:
+    orjson = None
 
-METRICS_RE = {
-    "p50_ms": re.compile(r"\bp50_ms\s*:\s*([0-9]+(?:\.[0-9]+)?)"),
-    "p90_ms": re.compile(r"\bp90_ms\s*:\s*([0-9]+(?:\.[0-9]+)?)"),
-    "p95_ms": re.compile(r"\bp95_ms\s*:\s*([0-9]+(?:\.[0-9]+)?)"),
-    "p99_ms": re.compile(r"\bp99_ms\s*:\s*([0-9]+(?:\.[0-9]+)?)"),
-    "dets_n": re.compile(r"\bdets_n\s*:\s*([0-9]+)\b"),
-}
+
+METRIC_KEYS = ("p50_ms", "p90_ms", "p95_ms", "p99_ms", "dets_n")
+
+# All metrics fused into one alternation: a single scan of the output instead
+# of one full-buffer search per metric
+METRICS_RE = re.compile(
+    r"\bp50_ms\s*:\s*(?P<p50_ms>[0-9]+(?:\.[0-9]+)?)"
+    r"|\bp90_ms\s*:\s*(?P<p90_ms>[0-9]+(?:\.[0-9]+)?)"
+    r"|\bp95_ms\s*:\s*(?P<p95_ms>[0-9]+(?:\.[0-9]+)?)"
+    r"|\bp99_ms\s*:\s*(?P<p99_ms>[0-9]+(?:\.[0-9]+)?)"
+    r"|\bdets_n\s*:\s*(?P<dets_n>[0-9]+)\b"
+)
 
 MAX_DETECTION_TIME_MS = 20.0
 
@@ -31,33 +46,33 @@ def calc_desired_threads(inter: int, intra: int, omp: int) -> int:
 
 
 def passes_max_threads(kv: Dict[str, Any], max_threads: int) -> Tuple[bool, int]:
-    ti = int(kv.get("threads_intra", 0) or 0)
-    te = int(kv.get("threads_inter", 0) or 0)
-    omp = int(kv.get("tile_omp", 0) or 0)
-    desired = calc_desired_threads(te, ti, omp)
-    return (desired <= int(max_threads)), desired
+    # Generators always emit int thread fields, so no reparsing here
+    desired = calc_desired_threads(kv["threads_inter"], kv["threads_intra"], kv["tile_omp"])
+    return (desired <= max_threads), desired
 
 
 def parse_metrics(text: str) -> Dict[str, Optional[float]]:
-    out: Dict[str, Optional[float]] = {k: None for k in METRICS_RE.keys()}
-    for k, rx in METRICS_RE.items():
-        m = rx.search(text)
-        if m:
-            try:
-                out[k] = float(m.group(1))
-            except ValueError:
-                out[k] = None
+    out: Dict[str, Optional[float]] = {k: None for k in METRIC_KEYS}
+    # Cheap C-level substring reject before the regex machinery spins up:
+    # crashed/failed runs usually emit no metric markers at all
+    if "_ms" not in text and "dets_n" not in text:
+        return out
+    remaining = len(METRIC_KEYS)
+    for m in METRICS_RE.finditer(text):
+        k = m.lastgroup
+        if out[k] is None:
+            out[k] = float(m.group(k))
+            remaining -= 1
+            if remaining == 0:
+                break
     return out
 
 
 def dets_n_int(metrics: Dict[str, Optional[float]]) -> Optional[int]:
+    # dets_n is captured as a plain digit run by METRICS_RE, so the cast
+    # cannot fail; no try/except machinery on this per-run path
     v = metrics.get("dets_n")
-    if v is None:
-        return None
-    try:
-        return int(v)
-    except Exception:
-        return None
+    return None if v is None else int(v)
 
 
 def floor_to_multiple(x: int, m: int) -> int:
@@ -66,12 +81,15 @@ def floor_to_multiple(x: int, m: int) -> int:
     return (x // m) * m
 
 
+@functools.lru_cache(maxsize=1024)
 def parse_tiles_rc(s: str) -> Tuple[int, int]:
-    parts = s.lower().split("x")
-    if len(parts) != 2:
+    # partition + isdigit instead of split/int: no throwaway list and no
+    # ValueError unwinding from int() on malformed input
+    rs, sep, cs = s.lower().partition("x")
+    if not sep or not rs.isdigit() or not cs.isdigit():
         raise ValueError(f"Bad tiles_rc '{s}', expected like '3x3'")
-    r = int(parts[0])
-    c = int(parts[1])
+    r = int(rs)
+    c = int(cs)
     if r <= 0 or c <= 0:
         raise ValueError(f"Bad tiles_rc '{s}', rows/cols must be >0")
     return r, c
@@ -83,48 +101,145 @@ def shell_join(argv: List[str]) -> str:
     return " ".join(shlex.quote(a) for a in argv)
 
 
+# Keeping only the last N lines, each clipped to a sane length, bounds memory
+# at O(1) per run instead of buffering the whole stdout
+RUN_TAIL_LINES = 200
+RUN_LINE_MAX_CHARS = 4096
+
+
 def run_one(cmd: List[str], timeout_s: float) -> Tuple[Dict[str, Optional[float]], str]:
     """
     Returns: (metrics, status)
     status: ok | timeout | no_metrics | failed
     """
+    tail: collections.deque = collections.deque(maxlen=RUN_TAIL_LINES)
+    marker_lines: List[str] = []
+
+    def _drain(stream) -> None:
+        # Pick out metric-marker lines while the child runs, so parsing later
+        # touches only those and never depends on markers fitting in the tail.
+        # A single pathological line (progress bar, dumped tensor) could still
+        # pin megabytes, so retained lines are clipped as well.
+        for line in stream:
+            if len(line) > RUN_LINE_MAX_CHARS:
+                line = line[:RUN_LINE_MAX_CHARS]
+            tail.append(line)
+            if ("_ms" in line or "dets_n" in line) and len(marker_lines) < 64:
+                marker_lines.append(line)
+
+    # close_fds=False keeps the launch on CPython's posix_spawn/vfork fast
+    # path instead of a full fork; no sensitive fds are held open here and
+    # thousands of short-lived children make the fork overhead measurable
+    p = subprocess.Popen(
+        cmd,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.STDOUT,
+        text=True,
+        encoding="utf-8",
+        errors="replace",
+        close_fds=False,
+    )
 
-    def _to_text(x: Any) -> str:
-        if x is None:
-            return ""
-        if isinstance(x, bytes):
-            return x.decode("utf-8", errors="replace")
-        return str(x)
+    reader = threading.Thread(target=_drain, args=(p.stdout,), daemon=True)
+    reader.start()
 
+    timed_out = False
     try:
-        p = subprocess.run(
-            cmd,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.STDOUT,
-            text=True,
-            encoding="utf-8",
-            errors="replace",
-            timeout=timeout_s,
-            check=False,
-        )
-        out = p.stdout or ""
-        metrics = parse_metrics(out)
+        rc = p.wait(timeout=timeout_s)
+    except subprocess.TimeoutExpired:
+        p.kill()
+        rc = p.wait()
+        timed_out = True
+    reader.join()
 
-        if p.returncode != 0:
-            return metrics, "failed"
+    metrics = parse_metrics("".join(marker_lines))
 
-        if all(metrics[k] is None for k in metrics.keys()):
-            return metrics, "no_metrics"
+    if timed_out:
+        return metrics, "timeout"
 
-        return metrics, "ok"
+    if rc != 0:
+        return metrics, "failed"
+
+    if all(metrics[k] is None for k in metrics.keys()):
+        return metrics, "no_metrics"
+
+    return metrics, "ok"
+
+
+def run_cache_key(cmd: List[str]) -> str:
+    return hashlib.sha256(shell_join(cmd).encode("utf-8")).hexdigest()
+
+
+def cache_loads(data: bytes) -> Any:
+    return orjson.loads(data) if orjson is not None else json.loads(data)
+
+
+def cache_dumps(obj: Any) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj).encode("utf-8")
+
+
+# One JSONL file instead of a file per run: loading is a single sequential
+# read and storing is an append, not a create+rename of a tiny file each time
+RunCache = Tuple[Dict[str, Tuple[Dict[str, Optional[float]], str]], Any]
+
+_CACHE_APPEND_LOCK = threading.Lock()
+
+
+def run_cache_open(cache_dir: Path) -> RunCache:
+    """Load existing entries from runs.jsonl and return (table, append handle)."""
+    path = cache_dir / "runs.jsonl"
+    table: Dict[str, Tuple[Dict[str, Optional[float]], str]] = {}
+    try:
+        with path.open("rb") as f:
+            for raw in f:
+                try:
+                    e = cache_loads(raw)
+                    table[e["key"]] = (e["metrics"], e["status"])
+                except (ValueError, KeyError):
+                    continue  # torn line from an interrupted sweep
+    except OSError:
+        pass
+    return table, path.open("ab")
+
+
+def run_cache_append(cache: RunCache, key: str, cmd: List[str],
+                     metrics: Dict[str, Optional[float]], status: str) -> None:
+    table, fp = cache
+    table[key] = (metrics, status)
+    entry = {"key": key, "cmd": shell_join(cmd), "metrics": metrics, "status": status}
+    with _CACHE_APPEND_LOCK:
+        try:
+            fp.write(cache_dumps(entry) + b"\n")
+            fp.flush()
+        except OSError:
+            pass  # cache is best-effort; never fail the run over it
 
-    except subprocess.TimeoutExpired as e:
-        out = _to_text(e.stdout)
-        err = _to_text(getattr(e, "stderr", None))
-        if err:
-            out = out + "\n" + err
-        metrics = parse_metrics(out)
-        return metrics, "timeout"
+
+def run_one_cached(
+    cmd: List[str], timeout_s: float, cache: Optional[RunCache]
+) -> Tuple[Dict[str, Optional[float]], str]:
+    """run_one with an on-disk result cache keyed by the joined command line.
+
+    Timeouts are never cached (they depend on --timeout, not the command),
+    so re-running with a larger budget retries them.
+    """
+    if cache is not None:
+        key = run_cache_key(cmd)
+        hit = cache[0].get(key)
+        if hit is not None:
+            return hit
+    metrics, status = run_one(cmd, timeout_s=timeout_s)
+    if cache is not None and status != "timeout":
+        run_cache_append(cache, key, cmd, metrics, status)
+    return metrics, status
+
+
+# Sweeps re-stringify the same handful of keys and small int values for every
+# command; interning them once spares thousands of throwaway allocations
+_FLAG_STRS: Dict[str, str] = {}
+_VALUE_STRS: Dict[Any, str] = {}
 
 
 def build_cmd(base_cmd: List[str], kv: Dict[str, Any]) -> List[str]:
@@ -132,7 +247,16 @@ def build_cmd(base_cmd: List[str], kv: Dict[str, Any]) -> List[str]:
     for k, v in kv.items():
         if v is None:
             continue
-        cmd += [f"--{k}", str(v)]
+        flag = _FLAG_STRS.get(k)
+        if flag is None:
+            flag = _FLAG_STRS.setdefault(k, f"--{k}")
+        if type(v) is str:
+            val = v
+        else:
+            val = _VALUE_STRS.get(v)
+            if val is None:
+                val = _VALUE_STRS.setdefault(v, str(v))
+        cmd += [flag, val]
     return cmd
 
 
@@ -141,10 +265,18 @@ def gen_single_shot(
     max_img_size_list: List[int],
     threads_intra_list: List[int],
     threads_inter_list: List[int],
-) -> Iterable[Dict[str, Any]]:
+    max_threads: int,
+) -> Iterable[Tuple[Dict[str, Any], int]]:
+    # Prefilter the thread axes so infeasible combos are never materialized
+    ti_list = [ti for ti in threads_intra_list if calc_desired_threads(1, ti, 1) <= max_threads]
+    te_list = [te for te in threads_inter_list if calc_desired_threads(te, 1, 1) <= max_threads]
+
     for fixed_hw, max_img_size, ti, te in itertools.product(
-        fixed_hw_list, max_img_size_list, threads_intra_list, threads_inter_list
+        fixed_hw_list, max_img_size_list, ti_list, te_list
     ):
+        desired = calc_desired_threads(te, ti, 1)
+        if desired > max_threads:
+            continue
         yield {
             "tiles_rc": "1x1",
             "tile_omp": 1,
@@ -152,38 +284,47 @@ def gen_single_shot(
             "max_img_size": max_img_size,
             "threads_intra": ti,
             "threads_inter": te,
-        }
+        }, desired
+
+
+@functools.lru_cache(maxsize=256)
+def fixed_hw_candidates(max_h: int, max_w: int, scales: Tuple[float, ...]) -> Tuple[Tuple[int, int], ...]:
+    """Scaled-and-floored (h, w) candidates with both sides >= 64, sorted ascending.
+
+    Memoized because different tiles_rc grids frequently collapse to the same
+    per-tile geometry, repeating the identical scale sweep.
+    """
+    cands = {
+        (floor_to_multiple(int(max_h * s), 32), floor_to_multiple(int(max_w * s), 32))
+        for s in scales
+    }
+    return tuple(sorted((hh, ww) for hh, ww in cands if hh >= 64 and ww >= 64))
 
 
 def gen_tiling(
-    tiles_rc_list: List[str],
+    tiling_geos: List[Tuple[str, int, int, int]],
     threads_intra_list: List[int],
     threads_inter_list: List[int],
-    fhd_w: int,
-    fhd_h: int,
     fixed_scales: List[float],
-) -> Iterable[Dict[str, Any]]:
-    for tiles_rc in tiles_rc_list:
-        r, c = parse_tiles_rc(tiles_rc)
-
-        max_h = floor_to_multiple((fhd_h // r), 32)
-        max_w = floor_to_multiple((fhd_w // c), 32)
-        if max_h <= 64 or max_w <= 64:
+    max_threads: int,
+) -> Iterable[Tuple[Dict[str, Any], int]]:
+    scales = tuple(fixed_scales)
+    for tiles_rc, max_h, max_w, omp in tiling_geos:
+        # Prefilter the thread axes against this grid's omp budget
+        ti_list = [ti for ti in threads_intra_list if calc_desired_threads(1, ti, omp) <= max_threads]
+        te_list = [te for te in threads_inter_list if calc_desired_threads(te, 1, omp) <= max_threads]
+        if not ti_list or not te_list:
             continue
 
-        fixed_set = set()
-        for s in fixed_scales:
-            hh = floor_to_multiple(int(max_h * s), 32)
-            ww = floor_to_multiple(int(max_w * s), 32)
-            if hh >= 64 and ww >= 64:
-                fixed_set.add((hh, ww))
-
-        fixed_hw_candidates = sorted(fixed_set, key=lambda x: (x[0], x[1]))
-        tile_omp_list = [r * c]
+        candidates = fixed_hw_candidates(max_h, max_w, scales)
+        tile_omp_list = [omp]
 
         for (hh, ww), ti, te, to in itertools.product(
-            fixed_hw_candidates, threads_intra_list, threads_inter_list, tile_omp_list
+            candidates, ti_list, te_list, tile_omp_list
         ):
+            desired = calc_desired_threads(te, ti, to)
+            if desired > max_threads:
+                continue
             yield {
                 "tiles_rc": tiles_rc,
                 "fixed_hw": f"{hh}x{ww}",
@@ -191,7 +332,14 @@ def gen_tiling(
                 "threads_inter": te,
                 "tile_omp": to,
                 "max_img_size": None,
-            }
+            }, desired
+
+
+def csv_field(s: str) -> str:
+    """Quote a CSV field per RFC 4180, but only when it actually needs it"""
+    if "," in s or '"' in s or "\n" in s:
+        return '"' + s.replace('"', '""') + '"'
+    return s
 
 
 def fmt_cell(v: Optional[float], status: str) -> str:
@@ -210,83 +358,132 @@ def extract_fields_from_kv(kv: Dict[str, Any]) -> Tuple[str, str, int, int, int,
     tiles_rc = str(kv.get("tiles_rc", "none"))
     fixed_hw = str(kv.get("fixed_hw", "none"))
 
-    ti = int(kv.get("threads_intra", 0) or 0)
-    te = int(kv.get("threads_inter", 0) or 0)
+    ti = kv["threads_intra"]
+    te = kv["threads_inter"]
 
-    omp_threads = int(kv.get("tile_omp", 0) or 0)
+    omp_threads = kv["tile_omp"]
     total_threads = omp_threads + max(ti, te)
 
     return tiles_rc, fixed_hw, ti, te, omp_threads, total_threads
 
 
-def max_hw_for_tiles_rc(fhd_h: int, fhd_w: int, tiles_rc: str) -> Tuple[int, int]:
+def hw_area(kv: Dict[str, Any]) -> int:
+    """Pixel area of kv's fixed_hw, or 0 when absent/malformed"""
+    hw = str(kv.get("fixed_hw") or "")
+    h, _, w = hw.partition("x")
+    if h.isdigit() and w.isdigit():
+        return int(h) * int(w)
+    return 0
+
+
+def run_group_key(kind: str, kv: Dict[str, Any]) -> Tuple[str, str, str, str]:
+    """Runs in one group differ only by fixed_hw, so runtime is monotonic in its area"""
+    return kind, str(kv.get("tiles_rc")), str(kv.get("threads_intra")), str(kv.get("threads_inter"))
+
+
+@functools.lru_cache(maxsize=1024)
+def tile_geo(fhd_h: int, fhd_w: int, tiles_rc: str) -> Tuple[int, int, int, int, int]:
+    """Cached per-grid geometry: (rows, cols, max_tile_h, max_tile_w, omp = rows*cols)."""
     r, c = parse_tiles_rc(tiles_rc)
     max_h = floor_to_multiple((fhd_h // r), 32)
     max_w = floor_to_multiple((fhd_w // c), 32)
+    return r, c, max_h, max_w, r * c
+
+
+def max_hw_for_tiles_rc(fhd_h: int, fhd_w: int, tiles_rc: str) -> Tuple[int, int]:
+    _r, _c, max_h, max_w, _omp = tile_geo(fhd_h, fhd_w, tiles_rc)
     return max_h, max_w
 
 
+def feasible_tiling_geos(
+    fhd_h: int, fhd_w: int, tiles_rc_list: List[str]
+) -> List[Tuple[str, int, int, int]]:
+    """(tiles_rc, max_tile_h, max_tile_w, omp) for grids whose tiles clear the 64 px floor.
+
+    Built once per sweep so the generator and the baseline picker don't each
+    re-derive and re-filter the same geometries.
+    """
+    geos = []
+    for tiles_rc in tiles_rc_list:
+        try:
+            _r, _c, max_h, max_w, omp = tile_geo(fhd_h, fhd_w, tiles_rc)
+        except ValueError:
+            continue
+        if max_h > 64 and max_w > 64:
+            geos.append((tiles_rc, max_h, max_w, omp))
+    return geos
+
+
 def pick_best_tiling_rc_by_tile_area(
-    fhd_h: int, fhd_w: int, tiling_tiles_rc: List[str], max_threads: int
+    tiling_geos: List[Tuple[str, int, int, int]], max_threads: int
 ) -> Optional[str]:
     best_rc = None
     best_area = -1
     best_rc_prod = None
 
-    for rc in tiling_tiles_rc:
-        try:
-            r, c = parse_tiles_rc(rc)
-            omp = r * c
-            # reference uses inter=1, intra=1 => ort_peak=1 => desired = omp + 1
-            if calc_desired_threads(1, 1, omp) > max_threads:
-                continue
-
-            max_h, max_w = max_hw_for_tiles_rc(fhd_h, fhd_w, rc)
-            if max_h <= 64 or max_w <= 64:
-                continue
+    for rc, max_h, max_w, omp in tiling_geos:
+        # reference uses inter=1, intra=1 => ort_peak=1 => desired = omp + 1
+        if calc_desired_threads(1, 1, omp) > max_threads:
+            continue
 
-            area = max_h * max_w
-            prod = omp
+        area = max_h * max_w
+        prod = omp
 
-            if area > best_area or (area == best_area and (best_rc_prod is None or prod < best_rc_prod)):
-                best_area = area
-                best_rc = rc
-                best_rc_prod = prod
-        except Exception:
-            continue
+        if area > best_area or (area == best_area and (best_rc_prod is None or prod < best_rc_prod)):
+            best_area = area
+            best_rc = rc
+            best_rc_prod = prod
     return best_rc
 
 
-def set_cli_kv(argv: List[str], key: str, value: Any) -> List[str]:
-    """Set/replace '--key value' in argv; append if missing"""
-    key = str(key)
-    val = str(value)
-    for i in range(len(argv) - 1):
-        if argv[i] == key:
-            argv[i + 1] = val
-            return argv
-    argv += [key, val]
+def argv_to_dict(argv: List[str]) -> Tuple[List[str], Dict[str, str]]:
+    """Split argv into positional tokens and an ordered '--flag value' dict"""
+    positional: List[str] = []
+    flags: Dict[str, str] = {}
+    i = 0
+    n = len(argv)
+    while i < n:
+        tok = argv[i]
+        if tok.startswith("--") and i + 1 < n:
+            flags[tok] = argv[i + 1]
+            i += 2
+        else:
+            positional.append(tok)
+            i += 1
+    return positional, flags
+
+
+def dict_to_argv(positional: List[str], flags: Dict[str, str]) -> List[str]:
+    argv = list(positional)
+    for k, v in flags.items():
+        argv += [k, v]
     return argv
 
 
+def make_ref_base_cmd(base_cmd: List[str]) -> List[str]:
+    # IMPORTANT: reference runs must be cheap
+    positional, flags = argv_to_dict(base_cmd)
+    flags.update({
+        "--warmup_iters": "1",
+        "--bench_iters": "1",
+        "--is_draw": "0",
+        "--is_dump": "0",
+        "--verbose": "0",
+    })
+    return dict_to_argv(positional, flags)
+
+
 def compute_reference_dets(
     kind: str,
-    base_cmd: List[str],
+    ref_base_cmd: List[str],
     timeout_s: float,
     fhd_h: int,
     fhd_w: int,
     single_max_img_size: List[int],
-    tiling_tiles_rc: List[str],
+    tiling_geos: List[Tuple[str, int, int, int]],
     max_threads: int,
+    run_cache: Optional[RunCache] = None,
 ) -> Optional[int]:
-    # IMPORTANT: reference run must be cheap
-    ref_base_cmd = list(base_cmd)
-    set_cli_kv(ref_base_cmd, "--warmup_iters", 1)
-    set_cli_kv(ref_base_cmd, "--bench_iters", 1)
-    set_cli_kv(ref_base_cmd, "--is_draw", 0)
-    set_cli_kv(ref_base_cmd, "--is_dump", 0)
-    set_cli_kv(ref_base_cmd, "--verbose", 0)
-
     if kind == "single":
         max_h = floor_to_multiple(fhd_h, 32)
         max_w = floor_to_multiple(fhd_w, 32)
@@ -308,7 +505,7 @@ def compute_reference_dets(
         cmd_str = shell_join(cmd)
         print(f"[REF] single-shot baseline run: fixed_hw={kv['fixed_hw']} desired_threads={desired} cmd={cmd_str}")
 
-        metrics, status = run_one(cmd, timeout_s=timeout_s)
+        metrics, status = run_one_cached(cmd, timeout_s, run_cache)
         if status != "ok":
             print(f"[REF][WARN] single baseline failed: status={status}")
             return None
@@ -317,17 +514,16 @@ def compute_reference_dets(
         return d
 
     if kind == "tiling":
-        best_rc = pick_best_tiling_rc_by_tile_area(fhd_h, fhd_w, tiling_tiles_rc, max_threads)
+        best_rc = pick_best_tiling_rc_by_tile_area(tiling_geos, max_threads)
         if not best_rc:
             print("[REF][WARN] tiling baseline: cannot pick tiles_rc under max_threads cap")
             return None
 
-        r, c = parse_tiles_rc(best_rc)
-        max_h, max_w = max_hw_for_tiles_rc(fhd_h, fhd_w, best_rc)
+        _r, _c, max_h, max_w, omp = tile_geo(fhd_h, fhd_w, best_rc)
 
         kv = {
             "tiles_rc": best_rc,
-            "tile_omp": r * c,
+            "tile_omp": omp,
             "fixed_hw": f"{max_h}x{max_w}",
             "max_img_size": None,
             "threads_intra": 1,
@@ -345,7 +541,7 @@ def compute_reference_dets(
             f"[REF] tiling baseline run: tiles_rc={best_rc} fixed_hw={kv['fixed_hw']} desired_threads={desired} cmd={cmd_str}"
         )
 
-        metrics, status = run_one(cmd, timeout_s=timeout_s)
+        metrics, status = run_one_cached(cmd, timeout_s, run_cache)
         if status != "ok":
             print(f"[REF][WARN] tiling baseline failed: status={status}")
             return None
@@ -376,13 +572,19 @@ def main():
     ap.add_argument("--max-threads", type=int, default=16, help="Max allowed desired_threads (default: 16)")
     ap.add_argument("--scale-dets", type=float, default=0.8, help="Filter: keep run only if dets_n >= ref_dets_n * scale_dets (default: 0.8)")
     ap.add_argument("--extra", type=str, default="", help="Extra args appended to command (quoted string)")
+    ap.add_argument("--cache-dir", dest="cache_dir", type=str, default=".grid_search_cache",
+                    help="Directory for cached run results (default: .grid_search_cache)")
+    ap.add_argument("--no-cache", dest="no_cache", action="store_true", help="Disable the on-disk run cache")
+    ap.add_argument("--jobs", type=int, default=0,
+                    help="Max concurrent runs; threads stay capped by --max-threads (0 = cpu count)")
 
     args = ap.parse_args()
 
-    fhd_h, fhd_w = (int(args.ref_hw.split("x")[0]), int(args.ref_hw.split("x")[1]))
+    ref_h_s, _, ref_w_s = args.ref_hw.partition("x")
+    fhd_h, fhd_w = int(ref_h_s), int(ref_w_s)
 
     base_cmd = [
-        args.exe,
+        os.fspath(args.exe),
         "--mode", args.mode,
         "--model", args.model,
         "--image", args.image,
@@ -411,22 +613,36 @@ def main():
     if args.extra.strip():
         base_cmd += shlex.split(args.extra)
 
+    max_threads_cap = int(args.max_threads)
+
     # Single mode
-    single_fixed_scales = [0.3 + dt * 0.05 for dt in range(15)]
-    single_fixed_hw = [
-        f"{floor_to_multiple(int(fhd_h * scale), 32)}x{floor_to_multiple(int(fhd_w * scale), 32)}"
-        for scale in single_fixed_scales
-    ]
-    single_fixed_hw = sorted({s for s in single_fixed_hw if not s.startswith("0x")})
+    single_fixed_scales = tuple(0.3 + dt * 0.05 for dt in range(15))
+    single_fixed_hw = [f"{hh}x{ww}" for hh, ww in fixed_hw_candidates(fhd_h, fhd_w, single_fixed_scales)]
     single_max_img_size = [960]
-    single_threads_intra = [i for i in range(1, args.max_threads + 1, 2)]
+    single_threads_intra = [i for i in range(1, max_threads_cap + 1, 2)]
     single_threads_inter = [1]
 
     # Tiling mode
-    tiling_tiles_rc = [f"{i}x{j}" for i in range(1, 100) for j in range(1, 100) if 1 < i * j <= int(args.max_threads)]
+    # Enumerate only grids under the cap (cols bounded by cap // rows) instead
+    # of filtering all 99x99 combinations
+    tiling_tiles_rc = [
+        f"{i}x{j}"
+        for i in range(1, max_threads_cap + 1)
+        for j in range(1, max_threads_cap // i + 1)
+        if i * j > 1
+    ]
     tiling_threads_intra = [1, 2, 4, 8, 16, 24, 32]
     tiling_threads_inter = [1]
     tiling_fixed_scales = [1.0, 0.7, 0.6, 0.5, 0.4, 0.3]
+    tiling_geos = feasible_tiling_geos(fhd_h, fhd_w, tiling_tiles_rc)
+
+    # Opened before the baselines so reference runs are cached too and a
+    # rerun of the exact same sweep skips them
+    run_cache: Optional[RunCache] = None
+    if not args.no_cache and not args.dry_run:
+        cache_root = Path(args.cache_dir)
+        cache_root.mkdir(parents=True, exist_ok=True)
+        run_cache = run_cache_open(cache_root)
 
     # --------------------------
     # Reference dets_n baselines
@@ -435,28 +651,33 @@ def main():
     ref_tiling: Optional[int] = None
 
     if not args.dry_run:
+        # Both baselines share the same cheapened command; build it once
+        ref_base_cmd = make_ref_base_cmd(base_cmd)
+
         if args.gen in ("single", "both"):
             ref_single = compute_reference_dets(
                 kind="single",
-                base_cmd=base_cmd,
+                ref_base_cmd=ref_base_cmd,
                 timeout_s=180,
                 fhd_h=fhd_h,
                 fhd_w=fhd_w,
                 single_max_img_size=single_max_img_size,
-                tiling_tiles_rc=tiling_tiles_rc,
-                max_threads=int(args.max_threads),
+                tiling_geos=tiling_geos,
+                max_threads=max_threads_cap,
+                run_cache=run_cache,
             )
 
         if args.gen in ("tiling", "both"):
             ref_tiling = compute_reference_dets(
                 kind="tiling",
-                base_cmd=base_cmd,
+                ref_base_cmd=ref_base_cmd,
                 timeout_s=180,
                 fhd_h=fhd_h,
                 fhd_w=fhd_w,
                 single_max_img_size=single_max_img_size,
-                tiling_tiles_rc=tiling_tiles_rc,
-                max_threads=int(args.max_threads),
+                tiling_geos=tiling_geos,
+                max_threads=max_threads_cap,
+                run_cache=run_cache,
             )
 
     def pass_dets_filter(kind: str, dets: Optional[int]) -> Tuple[bool, str]:
@@ -473,26 +694,32 @@ def main():
         return True, ""
 
     # --------------------------
-    # Generate runs with max_threads filter
+    # Generate runs (generators only yield combos under the max_threads cap)
     # --------------------------
-    runs: List[Tuple[str, Dict[str, Any]]] = []
-    skipped_threads = 0
+    runs: List[Tuple[str, Dict[str, Any], int]] = []
 
     if args.gen in ("single", "both"):
-        for kv in gen_single_shot(single_fixed_hw, single_max_img_size, single_threads_intra, single_threads_inter):
-            ok, _desired = passes_max_threads(kv, int(args.max_threads))
-            if not ok:
-                skipped_threads += 1
-                continue
-            runs.append(("single", kv))
+        runs += [
+            ("single", kv, desired)
+            for kv, desired in gen_single_shot(
+                single_fixed_hw, single_max_img_size, single_threads_intra, single_threads_inter,
+                max_threads_cap,
+            )
+        ]
 
     if args.gen in ("tiling", "both"):
-        for kv in gen_tiling(tiling_tiles_rc, tiling_threads_intra, tiling_threads_inter, fhd_w, fhd_h, tiling_fixed_scales):
-            ok, _desired = passes_max_threads(kv, int(args.max_threads))
-            if not ok:
-                skipped_threads += 1
-                continue
-            runs.append(("tiling", kv))
+        runs += [
+            ("tiling", kv, desired)
+            for kv, desired in gen_tiling(
+                tiling_geos, tiling_threads_intra, tiling_threads_inter,
+                tiling_fixed_scales, max_threads_cap,
+            )
+        ]
+
+    # Probe the cheapest geometry of each (kind, tiles_rc, threads) group first:
+    # once a small fixed_hw blows the p90 budget, every larger one in the same
+    # group is guaranteed slower and can be pruned without launching it
+    runs.sort(key=lambda e: (run_group_key(e[0], e[1]), hw_area(e[1])))
 
     out_path = Path(args.out)
     if out_path.parent and str(out_path.parent) not in ("", "."):
@@ -508,76 +735,126 @@ def main():
         "command",
     ]
 
-    with out_path.open("w", newline="", encoding="utf-8") as f:
-        w = csv.writer(f)
-        w.writerow(header)
-
-        done = 0
-        all_runs = len(runs)
-
-        for kind, kv in runs:
-            if args.max_runs and done >= args.max_runs:
-                break
-
-            ok, desired = passes_max_threads(kv, int(args.max_threads))
-            done += 1
-
-            if not ok:
-                print(f"[INFO] Progress: {done}/{all_runs} -> desired_threads={desired} > max_threads={args.max_threads} (skip)")
-                continue
-
-            cmd = build_cmd(base_cmd, kv)
-            cmd_str = shell_join(cmd)
-
-            if args.dry_run:
-                print(cmd_str)
-                continue
-
-            metrics, status = run_one(cmd, timeout_s=args.timeout)
-            if status != "ok":
-                print(f"[INFO] Progress: {done}/{all_runs} -> status={status} (skip)")
-                continue
+    to_run = runs[: args.max_runs] if args.max_runs else runs
+    all_runs = len(runs)
 
-            d = dets_n_int(metrics)
-            dets_passed, filter_msg = pass_dets_filter(kind, d)
-            if not dets_passed:
-                print(f"[INFO] Progress: {done}/{all_runs} -> {filter_msg} (skip)")
-                continue
+    with out_path.open("w", newline="", encoding="utf-8", buffering=1 << 20) as f:
+        f.write(",".join(header) + "\n")
 
-            p90 = metrics.get("p90_ms")
-            if p90 is None:
-                print(f"[INFO] Progress: {done}/{all_runs} -> p90_ms missing (skip)")
-                continue
-
-            if p90 > MAX_DETECTION_TIME_MS:
-                print(f"[INFO] Progress: {done}/{all_runs} -> p90_ms={p90:.4f} > {MAX_DETECTION_TIME_MS} (skip)")
-                continue
-
-            print(f"[INFO] Progress: {done}/{all_runs} -> p90_ms={p90:.4f}, dets_n={d}, desired_threads={desired}")
-
-            tiles_rc, fixed_hw, ti, te, omp_th, _total_th = extract_fields_from_kv(kv)
-
-            w.writerow([
-                fmt_cell(metrics.get("p99_ms"), status),
-                fmt_cell(metrics.get("p95_ms"), status),
-                fmt_cell(metrics.get("p90_ms"), status),
-                fmt_cell(metrics.get("p50_ms"), status),
+        done = 0
+        write_lock = threading.Lock()
 
-                "none" if d is None else str(d),
+        # Per group: smallest fixed_hw area seen over the p90 budget; larger
+        # areas in that group are dominated and skipped before launch
+        dominated: Dict[Tuple[str, str, str, str], int] = {}
 
-                tiles_rc,
-                fixed_hw,
-                ti,
-                te,
-                omp_th,
-                desired,
+        # Rows are batched to amortize write+flush syscalls across the sweep;
+        # each entry is a fully formatted CSV line (see csv_field)
+        pending_rows: List[str] = []
 
-                cmd_str,
-            ])
+        def flush_rows() -> None:
+            if pending_rows:
+                f.writelines(pending_rows)
+                pending_rows.clear()
             f.flush()
 
+        def finish_run(kind: str, kv: Dict[str, Any], desired: int, cmd_str: str,
+                       metrics: Dict[str, Optional[float]], status: str) -> None:
+            # Runs complete concurrently; serialize filtering/printing/writing
+            nonlocal done
+            with write_lock:
+                done += 1
+
+                if status != "ok":
+                    print(f"[INFO] Progress: {done}/{all_runs} -> status={status} (skip)")
+                    return
+
+                d = dets_n_int(metrics)
+                dets_passed, filter_msg = pass_dets_filter(kind, d)
+                if not dets_passed:
+                    print(f"[INFO] Progress: {done}/{all_runs} -> {filter_msg} (skip)")
+                    return
+
+                p90 = metrics.get("p90_ms")
+                if p90 is None:
+                    print(f"[INFO] Progress: {done}/{all_runs} -> p90_ms missing (skip)")
+                    return
+
+                if p90 > MAX_DETECTION_TIME_MS:
+                    gk = run_group_key(kind, kv)
+                    area = hw_area(kv)
+                    prev = dominated.get(gk)
+                    if area and (prev is None or area < prev):
+                        dominated[gk] = area
+                    print(f"[INFO] Progress: {done}/{all_runs} -> p90_ms={p90:.4f} > {MAX_DETECTION_TIME_MS} (skip)")
+                    return
+
+                print(f"[INFO] Progress: {done}/{all_runs} -> p90_ms={p90:.4f}, dets_n={d}, desired_threads={desired}")
+
+                tiles_rc, fixed_hw, ti, te, omp_th, _total_th = extract_fields_from_kv(kv)
+
+                # All cells except the command are formatted primitives that
+                # never need CSV quoting, so one f-string replaces the
+                # per-cell work csv.writer would do
+                pending_rows.append(
+                    f"{fmt_cell(metrics.get('p99_ms'), status)},"
+                    f"{fmt_cell(metrics.get('p95_ms'), status)},"
+                    f"{fmt_cell(metrics.get('p90_ms'), status)},"
+                    f"{fmt_cell(metrics.get('p50_ms'), status)},"
+                    f"{'none' if d is None else d},"
+                    f"{tiles_rc},{fixed_hw},{ti},{te},{omp_th},{desired},"
+                    f"{csv_field(cmd_str)}\n"
+                )
+                if len(pending_rows) >= 32:
+                    flush_rows()
+
+        if args.dry_run:
+            for _kind, kv, _desired in to_run:
+                print(shell_join(build_cmd(base_cmd, kv)))
+        else:
+            # Each run is an isolated subprocess capped at desired_threads, so
+            # schedule as many as fit under --max-threads in total
+            max_workers = args.jobs if args.jobs > 0 else max(1, os.cpu_count() or 4)
+            try:
+                with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+                    in_flight: Dict[concurrent.futures.Future, Tuple[str, Dict[str, Any], int, str]] = {}
+                    busy_threads = 0
+                    queue = collections.deque(to_run)
+
+                    while queue or in_flight:
+                        while queue:
+                            # desired_threads was computed once at generation time
+                            kind, kv, desired = queue[0]
+                            if in_flight and busy_threads + desired > max_threads_cap:
+                                break
+                            queue.popleft()
+                            floor_area = dominated.get(run_group_key(kind, kv))
+                            if floor_area is not None and hw_area(kv) >= floor_area:
+                                with write_lock:
+                                    done += 1
+                                    print(f"[INFO] Progress: {done}/{all_runs} -> dominated by slower smaller fixed_hw (skip)")
+                                continue
+                            cmd = build_cmd(base_cmd, kv)
+                            fut = executor.submit(run_one_cached, cmd, args.timeout, run_cache)
+                            in_flight[fut] = (kind, kv, desired, shell_join(cmd))
+                            busy_threads += desired
+
+                        completed, _pending = concurrent.futures.wait(
+                            in_flight, return_when=concurrent.futures.FIRST_COMPLETED
+                        )
+                        for fut in completed:
+                            kind, kv, desired, cmd_str = in_flight.pop(fut)
+                            busy_threads -= desired
+                            metrics, status = fut.result()
+                            finish_run(kind, kv, desired, cmd_str, metrics, status)
+            finally:
+                flush_rows()
+
+    if run_cache is not None:
+        run_cache[1].close()
+
     print(f"[OK] Saved: {out_path.resolve()}")
-    print(f"[OK] Candidate combos: {len(runs)} (skipped_by_max_threads={skipped_threads})")
+    print(f"[OK] Candidate combos: {len(runs)}")
 
 
 if __name__ == "__main__":
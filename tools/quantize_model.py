@@ -3,29 +3,123 @@
 import argparse
 import os
 
-from onnxruntime.quantization import QuantType, quantize_dynamic
+from onnxruntime.quantization import (
+    CalibrationDataReader,
+    QuantFormat,
+    QuantType,
+    quantize_dynamic,
+    quantize_static,
+)
+from onnxruntime.quantization.shape_inference import quant_pre_process
+
+
+class ImageCalibrationReader(CalibrationDataReader):
+    """Feeds preprocessed images from a folder to the static quantizer.
+
+    Preprocessing is the app's bench-path layout: BGR resize to a fixed HxW,
+    scale to [0, 1], NCHW float32 batch of one.
+    """
+
+    def __init__(self, calib_dir: str, calib_count: int, input_name: str, hw: str):
+        import cv2  # deferred: only the static path needs image decoding
+
+        h_s, _, w_s = hw.lower().partition("x")
+        h, w = int(h_s), int(w_s)
+
+        names = sorted(
+            n for n in os.listdir(calib_dir)
+            if n.lower().endswith((".jpg", ".jpeg", ".png", ".bmp"))
+        )[:calib_count]
+        if not names:
+            raise FileNotFoundError(f"No calibration images in: {calib_dir}")
+
+        self._cv2 = cv2
+        self._paths = [os.path.join(calib_dir, n) for n in names]
+        self._input_name = input_name
+        self._hw = (h, w)
+        self._it = iter(self._paths)
+
+    def get_next(self):
+        import numpy as np
+
+        for path in self._it:
+            img = self._cv2.imread(path)
+            if img is None:
+                continue
+            h, w = self._hw
+            img = self._cv2.resize(img, (w, h))
+            blob = img.astype(np.float32) / 255.0
+            blob = blob.transpose(2, 0, 1)[np.newaxis]
+            return {self._input_name: np.ascontiguousarray(blob)}
+        return None
+
+    def rewind(self):
+        self._it = iter(self._paths)
+
+
+def model_input_name(onnx_path: str) -> str:
+    import onnxruntime
+
+    sess = onnxruntime.InferenceSession(onnx_path, providers=["CPUExecutionProvider"])
+    return sess.get_inputs()[0].name
 
 
 def main():
     ap = argparse.ArgumentParser()
     ap.add_argument("--onnx", required=True)
     ap.add_argument("--output", default="quantized.onnx")
+    ap.add_argument("--mode", choices=["dynamic", "static"], default="dynamic",
+                    help="dynamic: weight-only int8; static: full int8 with calibration (enables VNNI kernels)")
+    ap.add_argument("--calib-dir", dest="calib_dir", default="",
+                    help="Folder of representative images (static mode only)")
+    ap.add_argument("--calib-count", dest="calib_count", type=int, default=64,
+                    help="Max calibration images to read (default: 64)")
+    ap.add_argument("--calib-hw", dest="calib_hw", default="640x640",
+                    help="Calibration input size HxW (default: 640x640)")
+    ap.add_argument("--per-channel", dest="per_channel", action=argparse.BooleanOptionalAction,
+                    default=True, help="Per-channel weight scales (default: on)")
     args = ap.parse_args()
 
     onnx_path = args.onnx
     out_path = args.output
 
-    if os.path.exists(onnx_path) and onnx_path.endswith(".onnx"):
-        quantize_dynamic(
-            model_input=onnx_path,
-            model_output=out_path,
-            weight_type=QuantType.QUInt8,
-            op_types_to_quantize=["Conv", "MatMul"],
-        )
-    else:
+    if not (os.path.exists(onnx_path) and onnx_path.endswith(".onnx")):
         raise FileNotFoundError("ONNX model not found")
 
+    # Fuse Conv+BN, fold constants and infer shapes first so the quantizer
+    # sees a cleaner graph and can cover more ops
+    pre_path = out_path + ".preprocessed.onnx"
+    quant_pre_process(onnx_path, pre_path, skip_symbolic_shape=False)
+
+    try:
+        if args.mode == "static":
+            if not args.calib_dir:
+                raise ValueError("--calib-dir is required for --mode static")
+            reader = ImageCalibrationReader(
+                args.calib_dir, args.calib_count, model_input_name(onnx_path), args.calib_hw,
+            )
+            quantize_static(
+                model_input=pre_path,
+                model_output=out_path,
+                calibration_data_reader=reader,
+                quant_format=QuantFormat.QDQ,
+                activation_type=QuantType.QInt8,
+                weight_type=QuantType.QInt8,
+                per_channel=args.per_channel,
+            )
+        else:
+            quantize_dynamic(
+                model_input=pre_path,
+                model_output=out_path,
+                weight_type=QuantType.QUInt8,
+                op_types_to_quantize=["Conv", "MatMul"],
+                per_channel=args.per_channel,
+                reduce_range=False,
+            )
+    finally:
+        if os.path.exists(pre_path):
+            os.remove(pre_path)
+
 
 if __name__ == "__main__":
     main()
-    
\ No newline at end of file